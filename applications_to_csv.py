@@ -21,8 +21,28 @@ from find_a_grant_csv.cli import run_pipeline_sync
     help="GGIS reference number for the grant",
 )
 @click.option("--api-key", required=True, help="API key for Find A Grant service API")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Directory for caching pages by ETag, e.g. '~/.cache/find-a-grant-csv'. "
+    "Unchanged pages are then not re-downloaded on later runs.",
+)
+@click.option(
+    "--write-buffer-bytes",
+    # open() treats buffering=1 as line buffering, not a 1-byte buffer.
+    type=click.IntRange(min=2),
+    default=1 << 20,
+    show_default=True,
+    help="Buffer size in bytes for writing the output CSV (at least 2).",
+)
 def cli(
-    output_csv: Path | None, api_base: str, ggis_reference_number: str, api_key: str
+    output_csv: Path | None,
+    api_base: str,
+    ggis_reference_number: str,
+    api_key: str,
+    cache_dir: Path | None,
+    write_buffer_bytes: int,
 ) -> None:
     """Fetch submissions, flatten to CSV, and write OUTPUT_CSV (or auto-name if omitted)."""
     out_path, num_apps, elapsed = run_pipeline_sync(
@@ -30,6 +50,8 @@ def cli(
         ggis_reference_number=ggis_reference_number,
         api_key=api_key,
         output_csv=output_csv,
+        cache_dir=cache_dir.expanduser() if cache_dir is not None else None,
+        write_buffer_bytes=write_buffer_bytes,
     )
     click.echo(f"Output written to: {out_path}")
     click.echo(f"Retrieved {num_apps} applications in {elapsed:.2f} seconds")
@@ -1,17 +1,30 @@
 from pathlib import Path
+import csv
+import datetime
 import re
 from .http_client import aggregate_all_pages_http
 from .csv_utils import (
     sanitize_col,
-    drop_constant_columns,
-    coerce_to_pairs,
+    iter_pairs,
     extract_row,
+    ConstantColumnTracker,
     ROOT_META_CANDIDATES,
     SUBMISSION_META_FIELDS,
 )
 import time
 import asyncio
 
+_NONALNUM_RE = re.compile(r"[^A-Za-z0-9]+")
+_CAMEL_RE = re.compile(r"([a-z0-9])([A-Z])")
+# Section separator columns are always kept, even though they are blank.
+_SECTION_SEPARATOR_RE = re.compile(r"^Section:\s")
+
+
+def to_snake_case(s: str) -> str:
+    s = _NONALNUM_RE.sub("_", s)
+    s = _CAMEL_RE.sub(r"\1_\2", s)
+    return s.strip("_").lower()
+
 
 async def run_pipeline(
     api_base: str,
@@ -19,6 +32,8 @@ async def run_pipeline(
     api_key: str,
     output_csv: Path | None = None,
     max_concurrent_requests: int = 20,
+    cache_dir: Path | None = None,
+    write_buffer_bytes: int = 1 << 20,
 ) -> tuple[Path, int, float]:
     """Core async pipeline used by the CLI.
 
@@ -26,11 +41,6 @@ async def run_pipeline(
     """
     start_time = time.time()
 
-    def to_snake_case(s: str) -> str:
-        s = re.sub(r"[^A-Za-z0-9]+", "_", s)
-        s = re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", s)
-        return s.strip("_").lower()
-
     submissions_path = "/api/open-data/submissions/{ggisReferenceNumber}"
     path = submissions_path.replace("{ggisReferenceNumber}", ggis_reference_number)
     api_base = api_base.rstrip("/")
@@ -38,48 +48,45 @@ async def run_pipeline(
         path = "/" + path
     base_url = f"{api_base}{path}"
 
-    # Decide output path (may require a preview request)
+    # Fetch all pages
+    merged = aggregate_all_pages_http(
+        base_url,
+        api_key,
+        max_concurrent_requests=max_concurrent_requests,
+        cache_dir=cache_dir,
+    )
+
+    # Decide output path, naming it after the form if none was given
     if output_csv is None:
-        merged_preview = aggregate_all_pages_http(
-            base_url,
-            api_key,
-            max_concurrent_requests=max_concurrent_requests,
-        )
         app_name = None
-        if "applications" in merged_preview:
-            if (
-                isinstance(merged_preview["applications"], list)
-                and merged_preview["applications"]
-            ):
-                app_name = merged_preview["applications"][0].get("applicationFormName")
-            elif isinstance(merged_preview["applications"], dict):
-                app_name = merged_preview["applications"].get("applicationFormName")
+        if "applications" in merged:
+            if isinstance(merged["applications"], list) and merged["applications"]:
+                app_name = merged["applications"][0].get("applicationFormName")
+            elif isinstance(merged["applications"], dict):
+                app_name = merged["applications"].get("applicationFormName")
         if not app_name:
             app_name = "applications"
-        today = __import__("datetime").date.today()
+        today = datetime.date.today()
         out_path = Path(
             f"{to_snake_case(app_name)}-{today.year}-{today.month:02d}-{today.day:02d}.csv"
         )
     else:
         out_path = output_csv
 
-    # Fetch all pages
-    merged = aggregate_all_pages_http(
-        base_url,
-        api_key,
-        max_concurrent_requests=max_concurrent_requests,
-    )
-
     # Flatten to rows
-    pairs = coerce_to_pairs(merged)
     meta_order = [sanitize_col(k) for k in ROOT_META_CANDIDATES] + [
         sanitize_col(k) for k in SUBMISSION_META_FIELDS
     ]
-    seen_headers = set(meta_order)
-    final_headers = list(dict.fromkeys(meta_order))
-    cache = []
-    all_cols_seen = set(final_headers)
-    for root_meta, sub in pairs:
+    # Insertion-ordered set of headers; re-adding a key keeps its position.
+    headers: dict[str, None] = dict.fromkeys(meta_order)
+    cache: list[dict[str, object]] = []
+    # Constant columns (except section separators) are found as rows come in.
+    constant_columns = ConstantColumnTracker(
+        ignore_empty=False, keep_patterns=[_SECTION_SEPARATOR_RE]
+    )
+    # Submissions are paired with their application metadata lazily and
+    # extracted as they come, so no intermediate list of pairs is built.
+    for root_meta, sub in iter_pairs(merged):
         meta, dyn, blocks = extract_row(
             root_meta,
             sub,
@@ -87,55 +94,41 @@ async def run_pipeline(
             prefix_section=False,
             add_section_separators=True,
         )
-        cache.append((meta, dyn, blocks))
-        all_cols_seen.update(meta.keys())
-        all_cols_seen.update(dyn.keys())
+        cells = {**meta, **dyn}
+        cache.append(cells)
+        constant_columns.add(cells)
         for section_header, block_cols in blocks:
-            if section_header and section_header not in seen_headers:
-                final_headers.append(section_header)
-                seen_headers.add(section_header)
-            for col in block_cols:
-                if col not in seen_headers:
-                    final_headers.append(col)
-                    seen_headers.add(col)
-    for c in all_cols_seen:
-        if c not in seen_headers:
-            final_headers.append(c)
-            seen_headers.add(c)
-    rows: list[dict[str, object]] = []
-    for meta, dyn, blocks in cache:
-        row: dict[str, object] = {h: "" for h in final_headers}
-        row.update(meta)
-        row.update(dyn)
-        rows.append(row)
-
-    # Drop constant columns (except section separators)
-    if rows:
-        import re as _re
-
-        keep_patterns = [_re.compile(r"^Section:\s")]  # keep all section separators
-        rows, _ = drop_constant_columns(
-            rows,
-            ignore_empty=False,
-            keep_patterns=keep_patterns,
-        )
-        if rows:
-            final_headers = list(rows[0].keys())
+            if section_header:
+                headers[section_header] = None
+            headers.update(dict.fromkeys(block_cols))
+    # Any cell column not placed by a section block goes at the end.
+    for c in constant_columns.columns:
+        headers.setdefault(c, None)
+    final_headers = [h for h in headers if not constant_columns.is_constant(h)]
 
-    # Write CSV
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    import csv
+    # Write CSV, building one positional row at a time
+    header_index = {h: i for i, h in enumerate(final_headers)}
+    template: list[object] = [""] * len(final_headers)
 
-    with out_path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(
-            f, fieldnames=final_headers, extrasaction="ignore", delimiter=","
-        )
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    def to_row(cells: dict[str, object]) -> list[object]:
+        row = template.copy()
+        for k, v in cells.items():
+            idx = header_index.get(k)
+            if idx is not None:
+                row[idx] = v
+        return row
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    # A large buffer lets writerows run in big chunks between write() calls.
+    with out_path.open(
+        "w", encoding="utf-8", newline="", buffering=write_buffer_bytes
+    ) as f:
+        writer = csv.writer(f, delimiter=",")
+        writer.writerow(final_headers)
+        writer.writerows(map(to_row, cache))
 
     elapsed = time.time() - start_time
-    num_apps = len(rows)
+    num_apps = len(cache)
     return out_path, num_apps, elapsed
 
 
@@ -145,6 +138,8 @@ def run_pipeline_sync(
     api_key: str,
     output_csv: Path | None = None,
     max_concurrent_requests: int = 20,
+    cache_dir: Path | None = None,
+    write_buffer_bytes: int = 1 << 20,
 ) -> tuple[Path, int, float]:
     """Synchronous wrapper around run_pipeline for non-async callers (like click)."""
     return asyncio.run(
@@ -154,5 +149,7 @@ def run_pipeline_sync(
             api_key=api_key,
             output_csv=output_csv,
             max_concurrent_requests=max_concurrent_requests,
+            cache_dir=cache_dir,
+            write_buffer_bytes=write_buffer_bytes,
         )
     )
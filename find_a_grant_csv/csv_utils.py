@@ -1,4 +1,6 @@
-from typing import Any, Dict, List, Tuple
+from functools import lru_cache
+import sys
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Set, Tuple
 import json
 import re
 
@@ -16,6 +18,15 @@ SUBMISSION_META_FIELDS = [
     "gapId",
 ]
 
+_WS_RE = re.compile(r"\s+")
+_NONALNUM_RE = re.compile(r"[^A-Za-z0-9]+")
+
+# Exact types of JSON scalars; bool is listed since it is not matched by int.
+_SCALAR_TYPES = frozenset({str, int, float, bool, type(None)})
+
+# Marks a column for which no (non-ignored) value has been seen yet.
+_UNSET = object()
+
 
 def extract_row(
     root_meta: Dict[str, Any],
@@ -25,16 +36,17 @@ def extract_row(
     prefix_section: bool,
     add_section_separators: bool,
 ) -> Tuple[Dict[str, Any], Dict[str, Any], List[Tuple[str, List[str]]]]:
+    # Values are converted to CSV-safe primitives as they are assigned.
     meta: Dict[str, Any] = {}
-    for k in ROOT_META_CANDIDATES:
-        if k in root_meta:
-            meta[sanitize_col(k)] = root_meta[k]
-    for k in SUBMISSION_META_FIELDS:
+    # A root meta field repeated on the submission takes the submission's value.
+    for k, col in _ROOT_META_COLS:
         if k in sub:
-            meta[sanitize_col(k)] = sub.get(k, "")
-    for k in ROOT_META_CANDIDATES:
+            meta[col] = try_json_cell(sub[k])
+        elif k in root_meta:
+            meta[col] = try_json_cell(root_meta[k])
+    for k, col in _SUBMISSION_META_COLS:
         if k in sub:
-            meta[sanitize_col(k)] = sub[k]
+            meta[col] = try_json_cell(sub[k])
 
     dynamic: Dict[str, Any] = {}
     blocks: List[Tuple[str, List[str]]] = []
@@ -60,59 +72,88 @@ def extract_row(
             if isinstance(resp, (dict, list)):
                 flat = flatten(col, resp)
                 for fk, fv in flat.items():
-                    dynamic[fk] = fv
+                    dynamic[fk] = try_json_cell(fv)
                     section_cols.append(fk)
             else:
                 if col in dynamic and not include_qid:
                     col = f"{col}__{sanitize_col(q_id) if q_id else 'dup'}"
-                dynamic[col] = resp
+                dynamic[col] = try_json_cell(resp)
                 section_cols.append(col)
 
         blocks.append((sep_header or "", section_cols))
 
-    # to CSV-safe primitives
-    meta = {k: try_json_cell(v) for k, v in meta.items()}
-    dynamic = {k: try_json_cell(v) for k, v in dynamic.items()}
     return meta, dynamic, blocks
 
 
+@lru_cache(maxsize=65536)
 def sanitize_col(name: str) -> str:
-    name = re.sub(r"\s+", " ", str(name)).strip()
-    name = re.sub(r"[^A-Za-z0-9]+", "_", name)
-    return name.strip("_") or "unnamed"
+    name = _WS_RE.sub(" ", str(name)).strip()
+    name = _NONALNUM_RE.sub("_", name)
+    # Interned so every row dict shares one key object per column.
+    return sys.intern(name.strip("_") or "unnamed")
+
+
+# (raw field, column name) pairs, sanitized once at import.
+_ROOT_META_COLS = [(k, sanitize_col(k)) for k in ROOT_META_CANDIDATES]
+_SUBMISSION_META_COLS = [(k, sanitize_col(k)) for k in SUBMISSION_META_FIELDS]
+
+
+def _json_cell(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+# Exact-type fast path for try_json_cell: one dict lookup instead of a chain
+# of isinstance checks for the types JSON decoding actually produces.
+_CELL_ENCODERS: Dict[type, Callable[[Any], Any]] = {
+    str: lambda obj: obj,
+    int: lambda obj: obj,
+    float: lambda obj: obj,
+    bool: lambda obj: obj,
+    type(None): lambda obj: "",
+    list: _json_cell,
+    dict: _json_cell,
+}
 
 
 def try_json_cell(obj: Any) -> Any:
+    encode = _CELL_ENCODERS.get(type(obj))
+    if encode is not None:
+        return encode(obj)
+    # Subclasses and other types keep the original isinstance semantics.
     if obj is None:
         return ""
     if isinstance(obj, (str, int, float)):
         return obj
     if isinstance(obj, (list, dict)):
-        return json.dumps(obj, ensure_ascii=False)
+        return _json_cell(obj)
     return str(obj)
 
 
 def flatten(prefix: str, value: Any) -> Dict[str, Any]:
     out: Dict[str, Any] = {}
-    if isinstance(value, dict):
-        for k, v in value.items():
-            col = sanitize_col(f"{prefix}_{k}")
-            if isinstance(v, (dict, list)):
-                out.update(flatten(col, v))
+    # Depth-first walk in document order. Paths are only sanitized at the
+    # leaves, since intermediate prefixes never become columns themselves.
+    stack: List[Tuple[str, Any]] = [(prefix, value)]
+    while stack:
+        path, v = stack.pop()
+        if isinstance(v, dict):
+            stack.extend((f"{path}_{k}", sv) for k, sv in reversed(v.items()))
+        elif isinstance(v, list):
+            if all(isinstance(x, str) for x in v):
+                # Common case (multi-select answers): join without str() calls.
+                out[sanitize_col(path)] = " | ".join(v)
+            elif _SCALAR_TYPES.issuperset(map(type, v)):
+                out[sanitize_col(path)] = " | ".join(
+                    "" if x is None else str(x) for x in v
+                )
             else:
-                out[col] = v
-    elif isinstance(value, list):
-        if all(isinstance(x, (str, int, float, type(None))) for x in value):
-            out[sanitize_col(prefix)] = " | ".join(
-                "" if x is None else str(x) for x in value
-            )
+                out[sanitize_col(path)] = json.dumps(v, ensure_ascii=False)
         else:
-            out[sanitize_col(prefix)] = json.dumps(value, ensure_ascii=False)
-    else:
-        out[sanitize_col(prefix)] = value
+            out[sanitize_col(path)] = v
     return out
 
 
+@lru_cache(maxsize=8192)
 def build_header_name(
     question_title: str,
     question_id: str | None,
@@ -125,12 +166,114 @@ def build_header_name(
         base = f"{sanitize_col(section_title)}__{base}"
     if include_qid and question_id:
         base = f"{base}__{sanitize_col(question_id)}"
-    return base
+    return sys.intern(base)
 
 
+@lru_cache(maxsize=1024)
 def section_separator_header(section_title: str) -> str:
     title = (section_title or "Untitled Section").strip()
-    return f"Section: {title}"
+    return sys.intern(f"Section: {title}")
+
+
+def _keep_matcher(keep_patterns: Sequence[re.Pattern[str]]) -> Callable[[str], bool]:
+    # One alternation regex means one search per column instead of one per
+    # pattern. Only plain patterns are merged: groups would be renumbered
+    # (breaking backreferences) or clash by name, differing flags can't
+    # share a regex, and global inline flags like "(?i)" fail to compile
+    # anywhere but the start.
+    if (
+        keep_patterns
+        and len({p.flags for p in keep_patterns}) == 1
+        and all(p.groups == 0 for p in keep_patterns)
+    ):
+        try:
+            keep_re = re.compile(
+                "|".join(f"(?:{p.pattern})" for p in keep_patterns),
+                keep_patterns[0].flags,
+            )
+        except re.error:
+            pass
+        else:
+
+            def force_keep(c: str) -> bool:
+                return keep_re.search(c) is not None
+
+            return force_keep
+
+    def force_keep_any(c: str) -> bool:
+        return any(p.search(c) for p in keep_patterns)
+
+    return force_keep_any
+
+
+class ConstantColumnTracker:
+    """Finds constant columns online, one row at a time.
+
+    Rows may be sparse: a column missing from a row counts as "" for it, as
+    if every row had been padded out to the full header first.
+    """
+
+    def __init__(
+        self,
+        *,
+        ignore_empty: bool,
+        keep_patterns: Sequence[re.Pattern[str]] = (),
+    ) -> None:
+        self.ignore_empty = ignore_empty
+        self.num_rows = 0
+        self._force_keep = _keep_matcher(keep_patterns)
+        # First value seen per column (_UNSET while only blanks were seen
+        # with ignore_empty), how many rows carried it, and the columns known
+        # not to be constant: keep-pattern matches, checked once when a column
+        # first appears, and columns seen to vary. Later rows skip the latter.
+        self._first: Dict[str, Any] = {}
+        self._counts: Dict[str, int] = {}
+        self._not_constant: Set[str] = set()
+
+    @property
+    def columns(self) -> List[str]:
+        """Every column seen so far, in first-seen order."""
+        return list(self._first)
+
+    @property
+    def undecided(self) -> int:
+        """How many of the columns seen so far could still be constant."""
+        return len(self._first) - len(self._not_constant)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.num_rows += 1
+        first_values, counts = self._first, self._counts
+        not_constant = self._not_constant
+        for c, v in row.items():
+            if c in not_constant:
+                continue
+            first = first_values.get(c, _UNSET)
+            if first is _UNSET and c not in first_values:
+                first_values[c] = _UNSET
+                if self._force_keep(c):
+                    not_constant.add(c)
+                    continue
+            if self.ignore_empty and str(v).strip() == "":
+                continue
+            if first is _UNSET:
+                first_values[c] = v
+                counts[c] = 1
+            elif v != first:
+                not_constant.add(c)
+            else:
+                counts[c] += 1
+
+    def is_constant(self, c: str) -> bool:
+        if not self.num_rows or c in self._not_constant:
+            return False
+        if c not in self._first and self._force_keep(c):
+            return False
+        if self.ignore_empty:
+            return True
+        # Rows missing the column hold "" there, so a partially present
+        # column is only constant if its one value is "" too.
+        count = self._counts.get(c, 0)
+        return count in (0, self.num_rows) or self._first[c] == ""
 
 
 def drop_constant_columns(
@@ -141,49 +284,49 @@ def drop_constant_columns(
 ) -> Tuple[List[Dict[str, Any]], List[str]]:
     if not rows:
         return rows, []
-    cols = list(rows[0].keys())
-    remove: List[str] = []
-
-    def force_keep(c: str) -> bool:
-        return any(p.search(c) for p in keep_patterns)
-
-    for c in cols:
-        if force_keep(c):
-            continue
-        vals = [r.get(c, "") for r in rows]
-        s = set(v for v in vals if str(v).strip() != "") if ignore_empty else set(vals)
-        if len(s) <= 1:
-            remove.append(c)
-    if remove:
-        rows = [{k: v for k, v in r.items() if k not in remove} for r in rows]
+    tracker = ConstantColumnTracker(
+        ignore_empty=ignore_empty, keep_patterns=keep_patterns
+    )
+    for r in rows:
+        tracker.add(r)
+        # Every column seen (all of rows[0]'s among them) is already known
+        # to be kept, so the remaining rows can't change the outcome.
+        if not tracker.undecided:
+            break
+    remove: List[str] = [c for c in rows[0] if tracker.is_constant(c)]
+    # Pruned in place: only the dropped keys are touched and no row is copied,
+    # so the returned rows are the caller's own dicts.
+    for r in rows:
+        for c in remove:
+            r.pop(c, None)
     return rows, remove
 
 
-def coerce_to_pairs(data: Any) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
-    pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
-    if isinstance(data, dict) and isinstance(data.get("applications"), list):
-        for app in data["applications"]:
+def iter_pairs(data: Any) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    # Look up the shape once; a single application object is treated as a
+    # one-element list of applications.
+    apps = data.get("applications") if isinstance(data, dict) else None
+    if isinstance(apps, dict):
+        apps = [apps]
+    if isinstance(apps, list):
+        for app in apps:
             root_meta = {k: v for k, v in app.items() if k != "submissions"}
-            subs = app.get("submissions", []) or []
-            for sub in subs:
-                pairs.append((root_meta, sub))
-    elif isinstance(data, dict) and isinstance(data.get("applications"), dict):
-        app = data["applications"]
-        root_meta = {k: v for k, v in app.items() if k != "submissions"}
-        subs = app.get("submissions", []) or []
-        for sub in subs:
-            pairs.append((root_meta, sub))
+            for sub in app.get("submissions", []) or []:
+                yield root_meta, sub
     elif isinstance(data, dict) and isinstance(data.get("submissions"), list):
         root_meta = {k: v for k, v in data.items() if k != "submissions"}
         for sub in data["submissions"]:
-            pairs.append((root_meta, sub))
+            yield root_meta, sub
     elif isinstance(data, list):
         for sub in data:
-            pairs.append(({}, sub))
+            yield {}, sub
     elif isinstance(data, dict) and any(
         k in data for k in ("submissionId", "sections")
     ):
-        pairs.append(({}, data))
+        yield {}, data
     else:
         raise ValueError("Unrecognised JSON shape for submissions.")
-    return pairs
+
+
+def coerce_to_pairs(data: Any) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    return list(iter_pairs(data))
@@ -1,10 +1,82 @@
-import random
+import contextlib
+import hashlib
+import os
 import sys
+import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+# One keep-alive connection pool shared by every page fetch, so the TCP/TLS
+# handshake is paid once per host rather than once per request.
+_SESSION = requests.Session()
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+# Transient failures are retried with exponential backoff, honouring
+# Retry-After. The loop lives in run_http_json rather than in urllib3's Retry:
+# requests reads the body after urllib3 hands back the response, so only a
+# loop around the whole get also covers a body cut off mid-download, and it
+# knows how many attempts were really made. MAX_ATTEMPTS counts the first try.
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.4
+BACKOFF_CAP = 4.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def ensure_pool_size(size: int) -> None:
+    """Grow the shared session's connection pool to hold `size` connections.
+
+    Called before fanning out, so every worker thread can keep its own
+    connection alive instead of overflowing the pool and reconnecting.
+    """
+    global _pool_size
+    with _pool_lock:
+        if size <= _pool_size:
+            return
+        old_adapters = {_SESSION.get_adapter(p) for p in ("https://", "http://")}
+        adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+        _SESSION.mount("https://", adapter)
+        _SESSION.mount("http://", adapter)
+        # Release the replaced pool's connections rather than leaking them.
+        for old in old_adapters:
+            old.close()
+        _pool_size = size
+
+
+# Matches the default max_concurrent_requests of the pipeline.
+ensure_pool_size(20)
+
+
+def _retry_delay(attempt: int, resp: Optional[requests.Response] = None) -> float:
+    """Seconds to wait after a failed `attempt`: the server's Retry-After if
+    it gave one, otherwise exponential backoff."""
+    retry_after = ""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "").strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    if retry_after:
+        try:
+            when = parsedate_to_datetime(retry_after)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    return min(BACKOFF_BASE * 2.0 ** (attempt - 1), BACKOFF_CAP)
 
 
 def find_total_pages(doc: Dict[str, Any]) -> int:
@@ -29,98 +101,138 @@ def find_total_pages(doc: Dict[str, Any]) -> int:
     return 1
 
 
+def cache_paths_for(cache_dir: Path, url: str) -> Tuple[Path, Path]:
+    """Return the (etag, body) cache file paths for a URL."""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return cache_dir / f"{key}.meta", cache_dir / f"{key}.json"
+
+
+def _replace_file(path: Path, content: bytes) -> None:
+    """Write `content` to `path` via a private temp file and os.replace."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_name)
+        raise
+
+
+def store_cached_page(paths: Tuple[Path, Path], etag: str, body: bytes) -> None:
+    """Write a page body and its ETag, each replaced atomically.
+
+    The old ETag is removed before the body is swapped, so an interrupted
+    write leaves a body without an ETag (refetched next time) rather than an
+    ETag paired with the wrong body.
+    """
+    meta_path, body_path = paths
+    # Pages hold applicant details, so the cache is private to the user.
+    body_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    meta_path.unlink(missing_ok=True)
+    _replace_file(body_path, body)
+    _replace_file(meta_path, etag.encode("utf-8"))
+
+
 def run_http_json(
     url: str,
     api_key: str,
     *,
-    timeout: int = 60,
-    max_retries: int = 3,
-    backoff_base: float = 0.4,
-    backoff_cap: float = 4.0,
+    timeout: float = 60,
     verbose: bool = False,
+    cache_dir: Optional[Path] = None,
 ) -> Dict[str, Any]:
     api_key = api_key.strip()
+    cache_paths = cache_paths_for(cache_dir, url) if cache_dir is not None else None
+    cached_etag: Optional[str] = None
+    if cache_paths is not None and all(p.is_file() for p in cache_paths):
+        cached_etag = cache_paths[0].read_text(encoding="utf-8").strip() or None
+    headers = {"x-api-key": api_key, "Accept": "application/json"}
+    if cached_etag:
+        headers["If-None-Match"] = cached_etag
+    if verbose:
+        print(f"[http] {url}", file=sys.stderr)
     attempt = 0
-    last_err: Optional[str] = None
     while True:
-        if attempt > 0:
-            delay = min(
-                backoff_base * (2 ** (attempt - 1)), backoff_cap
-            ) + random.uniform(0, backoff_base / 2)
-            time.sleep(delay)
-        else:
-            time.sleep(0.5)
         attempt += 1
-        headers = {"x-api-key": api_key, "Accept": "application/json"}
         try:
-            if verbose:
-                print(f"[http attempt {attempt}] {url}", file=sys.stderr)
-            resp: requests.Response = requests.get(
+            # Without stream=True, get() also downloads the whole body.
+            resp: requests.Response = _SESSION.get(
                 url, headers=headers, timeout=timeout
             )
-            text: str = resp.text
             if resp.status_code == 403:
-                last_err = "HTTP 403: Forbidden"
-                if verbose:
-                    print(f"[http error] HTTPError: {last_err}", file=sys.stderr)
-                raise Exception(last_err)
+                raise RuntimeError("HTTP 403: Forbidden")
             resp.raise_for_status()
-            try:
-                data = resp.json()
-            except Exception:
-                snippet = (text[:300] + "…") if len(text) > 300 else text
-                raise RuntimeError(
-                    f"HTTP returned non-JSON response (len={len(text)}). Snippet: {snippet}"
-                )
-
-            # Ensure we always return a dict[str, Any] for callers.
-            if not isinstance(data, dict):
-                snippet = (text[:300] + "…") if len(text) > 300 else text
-                raise RuntimeError(
-                    f"HTTP returned JSON that is not an object (len={len(text)}). Snippet: {snippet}"
-                )
-
-            if data.get("Message", "").lower().find("not authorized") >= 0:
-                raise RuntimeError(f"API responded with error: {data}")
-            return data
-        except Exception as e:
-            last_err = str(e)
+            break
+        except requests.RequestException as e:
             if verbose:
-                print(f"[http error] Exception: {last_err}", file=sys.stderr)
-        if attempt >= max_retries:
-            raise RuntimeError(f"HTTP failed after {max_retries} attempts: {last_err}")
+                print(f"[http error] {type(e).__name__}: {e}", file=sys.stderr)
+            transient = isinstance(e, _TRANSIENT_ERRORS) or (
+                e.response is not None and e.response.status_code in RETRY_STATUSES
+            )
+            if not transient or attempt >= MAX_ATTEMPTS:
+                tries = f" after {attempt} attempts" if attempt > 1 else ""
+                raise RuntimeError(f"HTTP failed{tries}: {e}") from e
+            time.sleep(_retry_delay(attempt, e.response))
+    not_modified = resp.status_code == 304 and cached_etag is not None
+    # Parse straight from bytes; only decode to str for error snippets.
+    body: bytes = (
+        cache_paths[1].read_bytes()
+        if not_modified and cache_paths is not None
+        else resp.content
+    )
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        text = body.decode("utf-8", errors="replace")
+        snippet = (text[:300] + "…") if len(text) > 300 else text
+        raise RuntimeError(
+            f"HTTP returned non-JSON response (len={len(text)}). Snippet: {snippet}"
+        )
+
+    # Ensure we always return a dict[str, Any] for callers.
+    if not isinstance(data, dict):
+        text = body.decode("utf-8", errors="replace")
+        snippet = (text[:300] + "…") if len(text) > 300 else text
+        raise RuntimeError(
+            f"HTTP returned JSON that is not an object (len={len(text)}). Snippet: {snippet}"
+        )
+
+    if data.get("Message", "").lower().find("not authorized") >= 0:
+        raise RuntimeError(f"API responded with error: {data}")
+    etag = resp.headers.get("ETag")
+    if cache_paths is not None and etag and not not_modified:
+        store_cached_page(cache_paths, etag, body)
+    return data
 
 
 def aggregate_all_pages_http(
     base_url: str,
     api_key: str,
     max_concurrent_requests: int = 10,
+    cache_dir: Optional[Path] = None,
 ) -> Dict[str, Any]:
-    first = run_http_json(base_url, api_key)
+    first = run_http_json(base_url, api_key, cache_dir=cache_dir)
     total_pages = max(find_total_pages(first), 1)
     if total_pages <= 1:
         return first
-    merged = first.copy() if isinstance(first, dict) else first
-
-    def extend_app_list(target: Dict[str, Any], page_data: Dict[str, Any]) -> None:
-        at, ap = target.get("applications"), page_data.get("applications")
-        if not isinstance(at, list) or not isinstance(ap, list):
-            return
-        for i in range(min(len(at), len(ap))):
-            at[i].setdefault("submissions", []).extend(
-                ap[i].get("submissions", []) or []
-            )
+    # Later pages are merged straight into the first page's document. A copy
+    # would buy nothing: the submissions lists being extended are shared.
+    merged = first
 
-    def extend_app_obj(target: Dict[str, Any], page_data: Dict[str, Any]) -> None:
-        at, ap = target.get("applications"), page_data.get("applications")
-        if not isinstance(at, dict) or not isinstance(ap, dict):
-            return
-        at.setdefault("submissions", []).extend(ap.get("submissions", []) or [])
+    # The document shape is fixed by the first page. Resolve, per page, the
+    # dicts that own a "submissions" list: each application (list or single
+    # object form) or, failing that, the document itself.
+    first_apps = merged.get("applications")
 
-    def extend_top_subs(target: Dict[str, Any], page_data: Dict[str, Any]) -> None:
-        target.setdefault("submissions", []).extend(
-            page_data.get("submissions", []) or []
-        )
+    def submission_holders(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+        apps = doc.get("applications")
+        if isinstance(first_apps, list):
+            return apps if isinstance(apps, list) else []
+        if isinstance(first_apps, dict):
+            return [apps] if isinstance(apps, dict) else []
+        return [doc]
 
     page_urls = [
         f"{base_url}{'&' if '?' in base_url else '?'}pageNumber={p}"
@@ -129,18 +241,29 @@ def aggregate_all_pages_http(
     page_results: List[Optional[Dict[str, Any]]] = [None] * (total_pages - 1)
 
     def fetch(url: str) -> Dict[str, Any]:
-        return run_http_json(url, api_key)
+        return run_http_json(url, api_key, cache_dir=cache_dir)
 
+    ensure_pool_size(max_concurrent_requests)
     with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
-        futures = [executor.submit(fetch, url) for url in page_urls]
-        for idx, fut in enumerate(futures):
+        futures = {
+            executor.submit(fetch, url): idx for idx, url in enumerate(page_urls)
+        }
+        for fut in as_completed(futures):
+            idx = futures[fut]
             try:
                 page_results[idx] = fut.result()
             except Exception as e:
+                # Leaving the with-block waits on the executor, so drop the
+                # queued pages first; only fetches already running finish.
+                for f in futures:
+                    f.cancel()
                 raise RuntimeError(f"Failed to fetch page {idx + 2}: {e}")
-    for page_data in page_results:
-        if page_data is not None:
-            extend_app_list(merged, page_data)
-            extend_app_obj(merged, page_data)
-            extend_top_subs(merged, page_data)
+    # Extend each target list once with every page's submissions, in page order.
+    page_holders = [submission_holders(p) for p in page_results if p is not None]
+    for i, holder in enumerate(submission_holders(merged)):
+        holder.setdefault("submissions", []).extend(
+            chain.from_iterable(
+                h[i].get("submissions", []) or [] for h in page_holders if i < len(h)
+            )
+        )
     return merged
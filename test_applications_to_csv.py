@@ -1,5 +1,22 @@
+import asyncio
+import csv
+import re
+import tempfile
 import unittest
-from find_a_grant_csv.csv_utils import extract_row, sanitize_col
+from pathlib import Path
+from typing import NoReturn
+from unittest import mock
+
+from find_a_grant_csv.cli import run_pipeline
+from find_a_grant_csv.csv_utils import (
+    ConstantColumnTracker,
+    coerce_to_pairs,
+    drop_constant_columns,
+    extract_row,
+    flatten,
+    sanitize_col,
+    try_json_cell,
+)
 
 
 class TestApplicationsToCsv(unittest.TestCase):
@@ -91,6 +108,194 @@ class TestApplicationsToCsv(unittest.TestCase):
             expected, f"test_form-{today.year}-{today.month:02d}-{today.day:02d}.csv"
         )
 
+    def test_drop_constant_columns(self) -> None:
+        rows = [
+            {"Section: A": "", "same": "x", "varies": 1, "sparse": ""},
+            {"Section: A": "", "same": "x", "varies": 2},
+            {"Section: A": "", "same": "x", "varies": 1, "sparse": "y"},
+        ]
+        out, removed = drop_constant_columns(
+            rows, ignore_empty=False, keep_patterns=[re.compile(r"^Section:\s")]
+        )
+        self.assertEqual(removed, ["same"])
+        self.assertEqual(list(out[0].keys()), ["Section: A", "varies", "sparse"])
+        self.assertIs(out[1], rows[1])
+        self.assertNotIn("same", rows[1])
+
+    def test_drop_constant_columns_ignore_empty(self) -> None:
+        rows = [{"a": "", "b": "1"}, {"a": "z", "b": " "}, {"a": "z", "b": "2"}]
+        _, removed = drop_constant_columns(rows, ignore_empty=True, keep_patterns=[])
+        self.assertEqual(removed, ["a"])
+
+    def test_drop_constant_columns_multiple_keep_patterns(self) -> None:
+        rows = [
+            {"Section: A": "", "keep_me": 1, "x": 1},
+            {"Section: A": "", "keep_me": 1, "x": 1},
+        ]
+        patterns = [re.compile(r"^Section:\s"), re.compile(r"^KEEP", re.IGNORECASE)]
+        _, removed = drop_constant_columns(
+            rows, ignore_empty=False, keep_patterns=patterns
+        )
+        self.assertEqual(removed, ["x"])
+
+    def test_constant_column_tracker_skips_decided_columns(self) -> None:
+        tracker = ConstantColumnTracker(
+            ignore_empty=False, keep_patterns=[re.compile(r"^Section:\s")]
+        )
+        tracker.add({"Section: A": "", "a": 1, "b": 1})
+        self.assertEqual(tracker.undecided, 2)
+        tracker.add({"Section: A": "", "a": 2, "b": 1})
+        self.assertEqual(tracker.undecided, 1)
+        self.assertEqual([c for c in tracker.columns if tracker.is_constant(c)], ["b"])
+
+    def test_drop_constant_columns_stops_once_all_columns_vary(self) -> None:
+        class Unread(dict[str, int]):
+            def items(self) -> NoReturn:
+                raise AssertionError("row scanned after every column varied")
+
+        rows = [{"a": 1, "b": 1}, {"a": 2, "b": 2}, Unread(a=2, b=2)]
+        _, removed = drop_constant_columns(rows, ignore_empty=False, keep_patterns=[])
+        self.assertEqual(removed, [])
+
+    def _removed_with(self, patterns: list[re.Pattern[str]]) -> list[str]:
+        rows = [{"Keep": 1, "KEEP2": 1, "bb": 1, "x": 1} for _ in range(2)]
+        _, removed = drop_constant_columns(
+            rows, ignore_empty=False, keep_patterns=patterns
+        )
+        return removed
+
+    def test_keep_patterns_with_global_inline_flags(self) -> None:
+        patterns = [re.compile(r"(?i)^keep$"), re.compile(r"(?i)^keep2$")]
+        self.assertEqual(self._removed_with(patterns), ["bb", "x"])
+
+    def test_keep_patterns_reusing_group_name(self) -> None:
+        patterns = [re.compile(r"^(?P<k>Keep)$"), re.compile(r"^(?P<k>KEEP2)$")]
+        self.assertEqual(self._removed_with(patterns), ["bb", "x"])
+
+    def test_keep_patterns_with_backreferences(self) -> None:
+        patterns = [re.compile(r"(a)\1"), re.compile(r"(b)\1")]
+        self.assertEqual(self._removed_with(patterns), ["Keep", "KEEP2", "x"])
+
+    def test_flatten_nested_order(self) -> None:
+        out = flatten(
+            "Address",
+            {"line 1": "1 Road", "geo": {"lat": 1, "lon!": 2}, "tags": ["a", None]},
+        )
+        self.assertEqual(
+            out,
+            {
+                "Address_line_1": "1 Road",
+                "Address_geo_lat": 1,
+                "Address_geo_lon": 2,
+                "Address_tags": "a | ",
+            },
+        )
+        self.assertEqual(
+            list(out),
+            ["Address_line_1", "Address_geo_lat", "Address_geo_lon", "Address_tags"],
+        )
+
+    def test_coerce_to_pairs_shapes(self) -> None:
+        app = {**self.root_meta, "submissions": [self.sub, self.sub]}
+        for data in ({"applications": [app]}, {"applications": app}, app):
+            pairs = coerce_to_pairs(data)
+            self.assertEqual(len(pairs), 2)
+            self.assertEqual(pairs[0][0], self.root_meta)
+            self.assertIs(pairs[0][1], self.sub)
+        self.assertEqual(coerce_to_pairs([self.sub]), [({}, self.sub)])
+        self.assertEqual(coerce_to_pairs(self.sub), [({}, self.sub)])
+        with self.assertRaises(ValueError):
+            coerce_to_pairs({"unexpected": True})
+
+    def test_try_json_cell(self) -> None:
+        self.assertEqual(try_json_cell(None), "")
+        self.assertEqual(try_json_cell("a"), "a")
+        self.assertIs(try_json_cell(True), True)
+        self.assertEqual(try_json_cell(2.5), 2.5)
+        self.assertEqual(try_json_cell({"k": "é"}), '{"k": "é"}')
+        self.assertEqual(try_json_cell([1, None]), "[1, null]")
+        self.assertEqual(try_json_cell(("t",)), "('t',)")
+
+    def test_run_pipeline_drops_constant_columns(self) -> None:
+        def sub(
+            n: int, details: list[tuple[str, object]], extra: bool
+        ) -> dict[str, object]:
+            sections = [
+                {
+                    "sectionTitle": "Details",
+                    "questions": [
+                        {"questionTitle": t, "questionId": t, "questionResponse": r}
+                        for t, r in details
+                    ],
+                }
+            ]
+            if extra:
+                sections.append(
+                    {
+                        "sectionTitle": "Extra",
+                        "questions": [
+                            {
+                                "questionTitle": "Only once",
+                                "questionId": "Q9",
+                                "questionResponse": "",
+                            }
+                        ],
+                    }
+                )
+            return {
+                "submissionId": f"S{n}",
+                "grantApplicantEmailAddress": "user@example.com",
+                "submittedTimeStamp": f"2025-11-1{n}T12:00:00Z",
+                "sections": sections,
+            }
+
+        merged = {
+            "applications": [
+                {
+                    **self.root_meta,
+                    "submissions": [
+                        sub(
+                            1,
+                            [
+                                ("Name", "A"),
+                                ("Blank", ""),
+                                ("Same", "x"),
+                                ("Partial", "p"),
+                            ],
+                            True,
+                        ),
+                        sub(2, [("Name", "B"), ("Blank", None), ("Same", "x")], False),
+                    ],
+                }
+            ]
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            out = Path(tmp) / "out.csv"
+            with mock.patch(
+                "find_a_grant_csv.cli.aggregate_all_pages_http", return_value=merged
+            ):
+                _, num_apps, _ = asyncio.run(
+                    run_pipeline("https://api.test", "GGIS-1", "key", out)
+                )
+            with out.open(newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(num_apps, 2)
+        self.assertEqual(
+            rows,
+            [
+                [
+                    "submissionId",
+                    "submittedTimeStamp",
+                    "Section: Details",
+                    "Name",
+                    "Partial",
+                    "Section: Extra",
+                ],
+                ["S1", "2025-11-11T12:00:00Z", "", "A", "p", ""],
+                ["S2", "2025-11-12T12:00:00Z", "", "B", "", ""],
+            ],
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,264 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+import requests
+
+from find_a_grant_csv import http_client
+
+URL = "https://api.test/subs"
+
+
+def make_response(
+    status: int, body: bytes = b"", etag: Optional[str] = None
+) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    resp.url = URL
+    if etag is not None:
+        resp.headers["ETag"] = etag
+    return resp
+
+
+# Pseudo-statuses for serve(): send 200 headers, then cut the body short or
+# stall until the client gives up.
+TRUNCATED = 0
+STALLED = 1
+
+
+class TestRetries(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(http_client, "_retry_delay", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, statuses: List[int]) -> Tuple[str, List[int]]:
+        """Answer with `statuses` in turn (repeating the last) from a local
+        server; return its URL and the list of statuses actually sent."""
+        sent: List[int] = []
+        release = threading.Event()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status = statuses[min(len(sent), len(statuses) - 1)]
+                sent.append(status)
+                body = b'{"ok": true}' if status in (200, TRUNCATED, STALLED) else b"{}"
+                self.send_response(200 if status in (TRUNCATED, STALLED) else status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if status == TRUNCATED:
+                    self.wfile.write(body[:4])
+                elif status == STALLED:
+                    self.wfile.flush()
+                    release.wait(5)
+                else:
+                    self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(release.set)
+        return f"http://127.0.0.1:{server.server_address[1]}/subs", sent
+
+    def test_transient_status_is_retried(self) -> None:
+        url, sent = self.serve([503, 503, 200])
+        self.assertEqual(http_client.run_http_json(url, "key"), {"ok": True})
+        self.assertEqual(sent, [503, 503, 200])
+
+    def test_retries_give_up_after_max_attempts(self) -> None:
+        url, sent = self.serve([503])
+        with self.assertRaisesRegex(
+            RuntimeError, f"after {http_client.MAX_ATTEMPTS} attempts"
+        ):
+            http_client.run_http_json(url, "key")
+        self.assertEqual(len(sent), http_client.MAX_ATTEMPTS)
+
+    def test_other_status_is_not_retried(self) -> None:
+        url, sent = self.serve([404, 200])
+        with self.assertRaisesRegex(RuntimeError, r"^HTTP failed: 404"):
+            http_client.run_http_json(url, "key")
+        self.assertEqual(sent, [404])
+
+    def test_truncated_body_is_retried(self) -> None:
+        url, sent = self.serve([TRUNCATED, 200])
+        self.assertEqual(http_client.run_http_json(url, "key"), {"ok": True})
+        self.assertEqual(sent, [TRUNCATED, 200])
+
+    def test_body_read_timeout_is_retried(self) -> None:
+        url, sent = self.serve([STALLED])
+        with self.assertRaisesRegex(
+            RuntimeError, f"after {http_client.MAX_ATTEMPTS} attempts"
+        ):
+            http_client.run_http_json(url, "key", timeout=0.2)
+        self.assertEqual(len(sent), http_client.MAX_ATTEMPTS)
+
+    def test_error_message_with_mocked_session(self) -> None:
+        cases = [
+            (requests.ConnectionError("refused"), http_client.MAX_ATTEMPTS),
+            (make_response(503), http_client.MAX_ATTEMPTS),
+            (make_response(404), 1),
+        ]
+        for outcome, attempts in cases:
+            with self.subTest(outcome=outcome):
+                kwargs: Dict[str, Any] = (
+                    {"side_effect": outcome}
+                    if isinstance(outcome, Exception)
+                    else {"return_value": outcome}
+                )
+                with mock.patch.object(http_client._SESSION, "get", **kwargs) as get:
+                    with self.assertRaises(RuntimeError) as ctx:
+                        http_client.run_http_json(URL, "key")
+                self.assertEqual(get.call_count, attempts)
+                self.assertEqual(
+                    f"after {attempts} attempts" in str(ctx.exception), attempts > 1
+                )
+
+
+class TestRetryDelay(unittest.TestCase):
+    def test_backoff_and_retry_after(self) -> None:
+        self.assertEqual(http_client._retry_delay(1), http_client.BACKOFF_BASE)
+        self.assertEqual(http_client._retry_delay(10), http_client.BACKOFF_CAP)
+        resp = make_response(503)
+        resp.headers["Retry-After"] = "7"
+        self.assertEqual(http_client._retry_delay(1, resp), 7.0)
+        resp.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+        self.assertEqual(http_client._retry_delay(1, resp), 0.0)
+        resp.headers["Retry-After"] = "soon"
+        self.assertEqual(http_client._retry_delay(2, resp), 0.8)
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = Path(tmp.name) / "cache"
+        self.meta_path, self.body_path = http_client.cache_paths_for(
+            self.cache_dir, URL
+        )
+
+    def fetch(self, resp: requests.Response) -> Tuple[Dict[str, Any], mock.Mock]:
+        with mock.patch.object(http_client._SESSION, "get", return_value=resp) as get:
+            data = http_client.run_http_json(URL, "key", cache_dir=self.cache_dir)
+        return data, get
+
+    def test_200_with_etag_is_stored(self) -> None:
+        data, _ = self.fetch(make_response(200, b'{"page": 1}', etag='"v1"'))
+        self.assertEqual(data, {"page": 1})
+        self.assertEqual(self.meta_path.read_text(), '"v1"')
+        self.assertEqual(self.body_path.read_bytes(), b'{"page": 1}')
+        if os.name == "posix":
+            mode = stat.S_IMODE(self.cache_dir.stat().st_mode)
+            self.assertEqual(mode, 0o700)
+
+    def test_200_without_etag_is_not_stored(self) -> None:
+        data, _ = self.fetch(make_response(200, b'{"page": 1}'))
+        self.assertEqual(data, {"page": 1})
+        self.assertFalse(self.meta_path.exists())
+        self.assertFalse(self.body_path.exists())
+
+    def test_304_reuses_cached_body(self) -> None:
+        http_client.store_cached_page(
+            (self.meta_path, self.body_path), '"v1"', b'{"page": "cached"}'
+        )
+        data, get = self.fetch(make_response(304, etag='"v1"'))
+        self.assertEqual(data, {"page": "cached"})
+        self.assertEqual(get.call_args.kwargs["headers"]["If-None-Match"], '"v1"')
+
+    def test_meta_without_body_sends_no_etag(self) -> None:
+        self.cache_dir.mkdir()
+        self.meta_path.write_text('"v1"')
+        data, get = self.fetch(make_response(200, b'{"page": 1}', etag='"v2"'))
+        self.assertEqual(data, {"page": 1})
+        self.assertNotIn("If-None-Match", get.call_args.kwargs["headers"])
+        self.assertEqual(self.meta_path.read_text(), '"v2"')
+
+    def test_interrupted_store_leaves_no_stale_etag(self) -> None:
+        pair = (self.meta_path, self.body_path)
+        http_client.store_cached_page(pair, '"v1"', b'{"page": 1}')
+        real_replace = os.replace
+
+        def fail_on_meta(src: str, dst: Path) -> None:
+            if dst == self.meta_path:
+                raise OSError("disk full")
+            real_replace(src, dst)
+
+        with mock.patch("os.replace", side_effect=fail_on_meta):
+            with self.assertRaises(OSError):
+                http_client.store_cached_page(pair, '"v2"', b'{"page": 2}')
+        self.assertFalse(self.meta_path.exists())
+        self.assertEqual(self.body_path.read_bytes(), b'{"page": 2}')
+        self.assertEqual(
+            sorted(p.name for p in self.cache_dir.iterdir()), [self.body_path.name]
+        )
+
+
+class TestEnsurePoolSize(unittest.TestCase):
+    def setUp(self) -> None:
+        # ensure_pool_size changes module-global state; put it back afterwards.
+        session = http_client._SESSION
+        adapters = {p: session.get_adapter(p) for p in ("https://", "http://")}
+        pool_size = http_client._pool_size
+
+        def restore() -> None:
+            replacement = session.get_adapter("https://")
+            for prefix, adapter in adapters.items():
+                session.mount(prefix, adapter)
+            if replacement not in adapters.values():
+                replacement.close()
+            http_client._pool_size = pool_size
+
+        self.addCleanup(restore)
+
+    def test_growing_closes_replaced_adapter(self) -> None:
+        old = http_client._SESSION.get_adapter("https://")
+        size = http_client._pool_size + 5
+        with mock.patch.object(old, "close") as close:
+            http_client.ensure_pool_size(size)
+        close.assert_called_once_with()
+        new = http_client._SESSION.get_adapter("https://")
+        self.assertIsNot(new, old)
+        self.assertIs(http_client._SESSION.get_adapter("http://"), new)
+        self.assertEqual(http_client._pool_size, size)
+
+    def test_smaller_size_keeps_adapter(self) -> None:
+        old = http_client._SESSION.get_adapter("https://")
+        http_client.ensure_pool_size(1)
+        self.assertIs(http_client._SESSION.get_adapter("https://"), old)
+
+
+class TestAggregateAllPages(unittest.TestCase):
+    def test_failed_page_cancels_queued_pages(self) -> None:
+        fetched: List[str] = []
+
+        def fake_run_http_json(url: str, api_key: str, **kwargs: Any) -> Dict[str, Any]:
+            fetched.append(url)
+            if url.endswith("pageNumber=2"):
+                raise RuntimeError("boom")
+            time.sleep(0.05)
+            return {"totalSubmissionPages": 20, "submissions": []}
+
+        with mock.patch.object(
+            http_client, "run_http_json", side_effect=fake_run_http_json
+        ):
+            with self.assertRaisesRegex(RuntimeError, "Failed to fetch page 2"):
+                http_client.aggregate_all_pages_http(
+                    "https://api.test/subs", "key", max_concurrent_requests=1
+                )
+        # At most the page the worker picked up next is still fetched.
+        self.assertLessEqual(len(fetched), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()